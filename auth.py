@@ -1,41 +1,55 @@
-import requests
+import logging
+import orjson
 from datetime import datetime, timedelta, timezone
-from config import supabase, INSTAGRAM_APP_ID, INSTAGRAM_APP_SECRET
-from utils import get_facebook_api_url
+from config import get_supabase, INSTAGRAM_APP_ID, INSTAGRAM_APP_SECRET
+from utils import get_facebook_api_url, parse_timestamp, graph_get
 from globals import RequestContext
 
+log = logging.getLogger(__name__)
+
+REFRESH_TOKEN_URL = "https://graph.instagram.com/refresh_access_token"
+
+# Assuming max lifetime is ~60 days (5184000 seconds)
+MAX_TOKEN_LIFETIME = timedelta(days=60)
+# Refresh if less than 10% of lifetime remains (approx 6 days)
+REFRESH_THRESHOLD = MAX_TOKEN_LIFETIME * 0.1
+
+# account id -> (raw token_expires_at, parsed datetime), kept for the life of the process
+_expiry_cache = {}
+
+def _token_expires_at(account):
+    """
+    Returns the parsed token expiry, reusing the cached value while the stored string is unchanged.
+    """
+    raw = account.token_expires_at
+    cached = _expiry_cache.get(account.id)
+    if cached and cached[0] == raw:
+        return cached[1]
+
+    expires_at = parse_timestamp(raw)
+    _expiry_cache[account.id] = (raw, expires_at)
+    return expires_at
+
 def refresh_token(account):
     """
     Checks if the account's token needs refreshing and refreshes it if necessary.
     """
-    access_token = account['access_token']
-    token_expires_at_str = account['token_expires_at']
-    
-    # Parse timestamp (handling potential format differences)
-    try:
-        token_expires_at = datetime.fromisoformat(token_expires_at_str.replace('Z', '+00:00'))
-        if token_expires_at.tzinfo is None:
-            token_expires_at = token_expires_at.replace(tzinfo=timezone.utc)
-    except ValueError:
-        # Fallback if format is different
-        token_expires_at = datetime.strptime(token_expires_at_str, "%Y-%m-%dT%H:%M:%S.%f%z")
-        if token_expires_at.tzinfo is None:
-            token_expires_at = token_expires_at.replace(tzinfo=timezone.utc)
-
+    access_token = account.access_token
     now = datetime.now(timezone.utc)
     
     # Calculate remaining lifetime
-    time_remaining = token_expires_at - now
-    
-    # Assuming max lifetime is ~60 days (5184000 seconds)
-    max_lifetime = timedelta(days=60)
+    time_remaining = _token_expires_at(account) - now
     
-    # Refresh if less than 10% of lifetime remains (approx 6 days)
-    if time_remaining < max_lifetime * 0.1:
-        print(f"Refreshing token for account {account['account_name']}...")
+    if time_remaining < REFRESH_THRESHOLD:
+        log.info("Refreshing token for account %s...", account.account_name)
         
-        if RequestContext.total_requests_this_run >= RequestContext.MAX_REQUESTS_ALLOWED:
-            print("Rate limit reached, skipping refresh.")
+        if not RequestContext.record_request():
+            log.warning("Rate limit reached, skipping refresh.")
+            return False
+
+        if not RequestContext.acquire_account_slot(account.ig_user_id):
+            RequestContext.release_request()
+            log.warning("Hourly limit reached for %s, skipping refresh.", account.account_name)
             return False
 
         params = {
@@ -44,30 +58,33 @@ def refresh_token(account):
         }
 
         try:
-            response = requests.get("https://graph.instagram.com/refresh_access_token", params=params)
-            RequestContext.total_requests_this_run += 1
+            response = graph_get(REFRESH_TOKEN_URL, params)
             
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 new_access_token = data['access_token']
                 expires_in_seconds = data.get('expires_in', 5184000) # Default to 60 days
                 new_expires_at = now + timedelta(seconds=expires_in_seconds)
                 
                 # Update DB
-                supabase.table('instagram_accounts').update({
+                get_supabase().table('instagram_accounts').update({
                     'access_token': new_access_token,
                     'token_expires_at': new_expires_at.isoformat(),
                     'updated_at': now.isoformat()
-                }).eq('id', account['id']).execute()
+                }).eq('id', account.id).execute()
+
+                # Keep the in-memory account current so the post fetch uses the new token
+                account.access_token = new_access_token
+                account.token_expires_at = new_expires_at.isoformat()
                 
-                print(f"Token refreshed successfully for {account['account_name']}.")
+                log.info("Token refreshed successfully for %s.", account.account_name)
                 return True
             else:
-                print(f"Failed to refresh token: {response.text}")
+                log.error("Failed to refresh token: %s", response.text)
                 return False
-        except Exception as e:
-            print(f"Error refreshing token: {e}")
+        except Exception:
+            log.exception("Error refreshing token")
             return False
     else:
-        print(f"Token for {account['account_name']} is still valid.")
+        log.info("Token for %s is still valid.", account.account_name)
         return True
@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
@@ -11,8 +12,12 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 INSTAGRAM_APP_ID = os.getenv("INSTAGRAM_APP_ID")
 INSTAGRAM_APP_SECRET = os.getenv("INSTAGRAM_APP_SECRET")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("Missing required environment variables: SUPABASE_URL or SUPABASE_KEY")
+@lru_cache(maxsize=1)
+def get_supabase() -> Client:
+    """
+    Returns the shared Supabase client, creating it on first use.
+    """
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise ValueError("Missing required environment variables: SUPABASE_URL or SUPABASE_KEY")
 
-# Initialize Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
@@ -1,3 +1,56 @@
+import threading
+import time
+from collections import deque
+
 class RequestContext:
     total_requests_this_run = 0
     MAX_REQUESTS_ALLOWED = 75
+    # Graph API allows ~200 calls per hour per user token
+    MAX_REQUESTS_PER_ACCOUNT_PER_HOUR = 200
+    _lock = threading.Lock()
+    _account_calls = {}
+
+    @classmethod
+    def reset(cls):
+        """
+        Starts a new run with an empty request budget.
+        """
+        with cls._lock:
+            cls.total_requests_this_run = 0
+
+    @classmethod
+    def record_request(cls):
+        """
+        Reserves one Graph API request from this run's budget.
+        Check and increment happen under one lock, so concurrent account
+        workers can't overshoot MAX_REQUESTS_ALLOWED. Returns False once it's spent.
+        """
+        with cls._lock:
+            if cls.total_requests_this_run >= cls.MAX_REQUESTS_ALLOWED:
+                return False
+            cls.total_requests_this_run += 1
+            return True
+
+    @classmethod
+    def release_request(cls):
+        """
+        Returns a reserved request to this run's budget when the call isn't made after all.
+        """
+        with cls._lock:
+            cls.total_requests_this_run -= 1
+
+    @classmethod
+    def acquire_account_slot(cls, ig_user_id):
+        """
+        Reserves one call from the account's hourly quota.
+        Returns False if the account has used it up within this process.
+        """
+        now = time.monotonic()
+        with cls._lock:
+            calls = cls._account_calls.setdefault(ig_user_id, deque())
+            while calls and now - calls[0] >= 3600:
+                calls.popleft()
+            if len(calls) >= cls.MAX_REQUESTS_PER_ACCOUNT_PER_HOUR:
+                return False
+            calls.append(now)
+            return True
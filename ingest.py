@@ -1,150 +1,225 @@
-import requests
+import logging
+import orjson
 from datetime import datetime, timezone
-from config import supabase
-from utils import get_instagram_api_url
+from postgrest import APIError, ReturnMethod
+from config import get_supabase
+from utils import get_instagram_api_url, parse_timestamp, graph_get
 from globals import RequestContext
 
+log = logging.getLogger(__name__)
+
+# Fixed query parameters for the media edge; only the token varies per account
+MEDIA_PARAMS = {
+    'fields': 'id,caption,media_type,media_url,permalink,timestamp',
+    'limit': 50
+}
+MEDIA_URL_PARAMS = {'fields': 'media_url,permalink'}
+
+# Rows per request for backfills
+UPSERT_CHUNK_SIZE = 500
+
+def _upsert_chunk(records):
+    # returning=minimal: PostgREST doesn't echo the written rows back
+    get_supabase().table('instagram_posts').upsert(records, on_conflict='media_id', returning=ReturnMethod.minimal).execute()
+
+def _upsert_isolating(records):
+    """
+    Upserts records, splitting a request the database rejects in half until the
+    bad rows are isolated, so only those rows are dropped.
+    Returns (written, rejected). Connection errors are raised; splitting wouldn't
+    help with those.
+    """
+    try:
+        _upsert_chunk(records)
+        return len(records), 0
+    except APIError as e:
+        if len(records) == 1:
+            log.error("Post %s rejected: %s", records[0]['media_id'], e.message)
+            return 0, 1
+
+    mid = len(records) // 2
+    written, rejected = _upsert_isolating(records[:mid])
+    more_written, more_rejected = _upsert_isolating(records[mid:])
+    return written + more_written, rejected + more_rejected
+
+def _upsert_posts(records, backfill=False):
+    """
+    Upserts post records in one request, splitting it up if the database rejects
+    it so a single bad row doesn't drop the whole sync. A first sync (backfill)
+    can pull thousands of historical posts, so it goes straight to chunks.
+    Returns (written, rejected); rows that are neither failed on a transient error.
+    """
+    chunk_size = UPSERT_CHUNK_SIZE if backfill else len(records)
+    written = rejected = 0
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start:start + chunk_size]
+        try:
+            chunk_written, chunk_rejected = _upsert_isolating(chunk)
+            written += chunk_written
+            rejected += chunk_rejected
+        except Exception:
+            log.exception("Error inserting posts %d-%d", start, start + len(chunk) - 1)
+    return written, rejected
+
 def fetch_new_posts(account):
     """
     Fetches new posts for the account and inserts them into the database.
     """
-    ig_user_id = account['ig_user_id']
-    access_token = account['access_token']
-    last_synced_at_str = account.get('last_synced_at')
+    ig_user_id = account.ig_user_id
+    access_token = account.access_token
+    last_synced_at_str = account.last_synced_at
     
     last_synced_at = None
     if last_synced_at_str:
         try:
-            last_synced_at = datetime.fromisoformat(last_synced_at_str.replace('Z', '+00:00'))
-            if last_synced_at.tzinfo is None:
-                last_synced_at = last_synced_at.replace(tzinfo=timezone.utc)
+            last_synced_at = parse_timestamp(last_synced_at_str)
         except ValueError:
             pass
 
-    print(f"Fetching posts for {account['account_name']}...")
+    # Compare epoch seconds in the per-post loop instead of aware datetimes
+    cutoff = last_synced_at.timestamp() if last_synced_at else None
+
+    log.info("Fetching posts for %s...", account.account_name)
     
     url = get_instagram_api_url(f"{ig_user_id}/media")
-    params = {
-        'fields': 'id,caption,media_type,media_url,permalink,timestamp',
-        'limit': 50,
-        'access_token': access_token
-    }
+    params = {**MEDIA_PARAMS, 'access_token': access_token}
     
     newest_post_timestamp = None
-    posts_inserted = 0
+    # Keyed by media_id: a post published mid-sync shifts the pages, and one upsert
+    # statement can't touch the same key twice
+    batch = {}
+    # Set only when pagination reaches the cutoff or the end of the media list
+    completed = False
+    # Set when the run budget or the account's hourly slots run out mid-fetch. Every run
+    # restarts from the newest page, so an account with more new pages than the budget
+    # covers would never complete; the cursor advances past what was written instead and
+    # the skipped range is logged.
+    budget_exhausted = False
+    oldest_post_timestamp = None
+    # One ingest time for every record written in this sync
+    now_iso = datetime.now(timezone.utc).isoformat()
     
     while url:
-        if RequestContext.total_requests_this_run >= RequestContext.MAX_REQUESTS_ALLOWED:
-            print("Rate limit reached, stopping fetch.")
+        if not RequestContext.record_request():
+            log.warning("Rate limit reached, stopping fetch.")
+            budget_exhausted = True
+            break
+
+        if not RequestContext.acquire_account_slot(ig_user_id):
+            RequestContext.release_request()
+            log.warning("Hourly limit reached for %s, stopping fetch.", account.account_name)
+            budget_exhausted = True
             break
             
         try:
-            response = requests.get(url, params=params if 'access_token' not in url else None)
-            RequestContext.total_requests_this_run += 1
+            response = graph_get(url, params)
+            # paging.next URLs already carry fields, limit, cursor and token
+            params = None
             
             if response.status_code != 200:
-                print(f"Error fetching posts: {response.text}")
+                log.error("Error fetching posts: %s", response.text)
                 break
                 
-            data = response.json()
+            data = orjson.loads(response.content)
             posts = data.get('data', [])
             
             if not posts:
+                completed = True
                 break
+
+            # Media is returned newest-first, so the first post seen is the newest
+            if newest_post_timestamp is None:
+                newest_post_timestamp = parse_timestamp(posts[0]['timestamp'])
                 
             for post in posts:
-                post_timestamp_str = post['timestamp']
-                post_timestamp = datetime.fromisoformat(post_timestamp_str.replace('Z', '+00:00'))
-                if post_timestamp.tzinfo is None:
-                    post_timestamp = post_timestamp.replace(tzinfo=timezone.utc)
-                
-                # Track newest timestamp seen in this run
-                if newest_post_timestamp is None:
-                    newest_post_timestamp = post_timestamp
-                elif post_timestamp > newest_post_timestamp:
-                    newest_post_timestamp = post_timestamp
+                post_timestamp = parse_timestamp(post['timestamp'])
                 
                 # Stop if we reach posts older than last sync
-                if last_synced_at and post_timestamp <= last_synced_at:
-                    print("Reached previously synced posts.")
+                if cutoff is not None and post_timestamp.timestamp() <= cutoff:
+                    log.info("Reached previously synced posts.")
+                    completed = True
                     url = None # Stop pagination
                     break
                 
-                # Check for duplicates (media_id)
-                post_record = {
+                batch[post['id']] = {
                     'media_id': post['id'],
                     'ig_user_id': ig_user_id,
                     'caption': post.get('caption'),
                     'media_url': post.get('media_url') or post.get('permalink'), # Fallback to permalink if media_url missing
                     'timestamp': post_timestamp.isoformat(),
-                    'created_at': datetime.now(timezone.utc).isoformat()
+                    'created_at': now_iso
                 }
-                
-                try:
-                    # Using upsert with ignoreDuplicates=True equivalent (on_conflict='do nothing' logic)
-                    supabase.table('instagram_posts').upsert(post_record, on_conflict='media_id').execute()
-                    posts_inserted += 1
-                except Exception as e:
-                    print(f"Error inserting post {post['id']}: {e}")
-
-            # Pagination
-            paging = data.get('paging', {})
-            url = paging.get('next')
+                oldest_post_timestamp = post_timestamp
+
+            # Pagination (media is newest-first, so nothing past the cutoff is new)
+            if url:
+                paging = data.get('paging', {})
+                url = paging.get('next')
+                completed = url is None
             
-        except Exception as e:
-            print(f"Exception during fetch: {e}")
+        except Exception:
+            log.exception("Exception during fetch")
             break
-            
-    # Update last_synced_at if we found new posts
-    if newest_post_timestamp:
+
+    # Write every page collected for this account in one round trip
+    posts_inserted, posts_rejected = _upsert_posts(list(batch.values()), backfill=last_synced_at is None) if batch else (0, 0)
+
+    # Update last_synced_at if we found new posts. If pagination stopped early on an error or
+    # any rows failed to write, leave the cursor where it was so the next run fetches the gap again
+    # instead of skipping past it. Rows the database rejected would fail the same way on
+    # every run, so they are logged and don't hold the cursor back.
+    if not (completed or budget_exhausted):
+        log.warning("Fetch for %s stopped before reaching previously synced posts, not advancing last_synced_at.", account.account_name)
+    elif posts_inserted + posts_rejected < len(batch):
+        log.warning("Only %d/%d posts written for %s, not advancing last_synced_at.", posts_inserted, len(batch), account.account_name)
+    elif newest_post_timestamp:
         # If last_synced_at was None, or we found newer posts
         if last_synced_at is None or newest_post_timestamp > last_synced_at:
-            supabase.table('instagram_accounts').update({
+            if not completed:
+                log.warning("Request budget ran out for %s; posts before %s back to %s were not fetched.",
+                            account.account_name, oldest_post_timestamp.isoformat(), last_synced_at.isoformat() if last_synced_at else 'the first post')
+            get_supabase().table('instagram_accounts').update({
                 'last_synced_at': newest_post_timestamp.isoformat(),
                 'updated_at': datetime.now(timezone.utc).isoformat()
-            }).eq('id', account['id']).execute()
+            }).eq('id', account.id).execute()
             
-    print(f"Inserted {posts_inserted} new posts for {account['account_name']}.")
+    log.info("Inserted %d new posts for %s.", posts_inserted, account.account_name)
 
 def refresh_post_media_url(media_id, access_token):
     """
     Refreshes the media_url for a specific post by fetching it again from Instagram.
     Useful when the stored media_url expires (returns 403).
     """
-    print(f"Refreshing media URL for post {media_id}...")
+    log.info("Refreshing media URL for post %s...", media_id)
     
-    if RequestContext.total_requests_this_run >= RequestContext.MAX_REQUESTS_ALLOWED:
-        print("Rate limit reached, cannot refresh media URL.")
+    if not RequestContext.record_request():
+        log.warning("Rate limit reached, cannot refresh media URL.")
         return False
 
     url = get_instagram_api_url(f"{media_id}")
-    params = {
-        'fields': 'media_url,permalink',
-        'access_token': access_token
-    }
+    params = {**MEDIA_URL_PARAMS, 'access_token': access_token}
 
     try:
-        response = requests.get(url, params=params)
-        RequestContext.total_requests_this_run += 1
+        response = graph_get(url, params)
 
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             new_media_url = data.get('media_url') or data.get('permalink')
             
             if new_media_url:
                 # Update DB
-                supabase.table('instagram_posts').update({
+                get_supabase().table('instagram_posts').update({
                     'media_url': new_media_url
                 }).eq('media_id', media_id).execute()
                 
-                print(f"Successfully refreshed media URL for post {media_id}.")
+                log.info("Successfully refreshed media URL for post %s.", media_id)
                 return True
             else:
-                print(f"No media_url found for post {media_id}.")
+                log.warning("No media_url found for post %s.", media_id)
                 return False
         else:
-            print(f"Failed to refresh media URL: {response.text}")
+            log.error("Failed to refresh media URL: %s", response.text)
             return False
-    except Exception as e:
-        print(f"Error refreshing media URL: {e}")
+    except Exception:
+        log.exception("Error refreshing media URL")
         return False
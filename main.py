@@ -1,52 +1,67 @@
-import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from config import supabase
+from config import get_supabase
+from models import ACCOUNT_COLUMNS, Account
 from globals import RequestContext
 from auth import refresh_token
 from ingest import fetch_new_posts
 from seed import seed_initial_account
+from utils import configure_logging
+
+log = logging.getLogger(__name__)
+
+# Number of accounts synced concurrently
+MAX_WORKERS = 8
+
+def _process_account(account):
+    """
+    Refreshes the token and fetches new posts for a single account.
+    """
+    if RequestContext.total_requests_this_run >= RequestContext.MAX_REQUESTS_ALLOWED:
+        log.warning("Max requests allowed reached for this batch. Skipping %s.", account.account_name)
+        return
+
+    # 1. Refresh Token
+    refresh_token(account)
+    
+    # Check limit again
+    if RequestContext.total_requests_this_run >= RequestContext.MAX_REQUESTS_ALLOWED:
+        return
+        
+    # 2. Fetch New Posts
+    fetch_new_posts(account)
 
 def run_batch():
     """
     Orchestrates the sync process for all accounts.
     """
     
-    print(f"Starting batch run at {datetime.now()}")
+    log.info("Starting batch run at %s", datetime.now())
     
     # Fetch accounts sorted by priority and last_synced_at
-    response = supabase.table('instagram_accounts').select("*").order('priority', desc=False).order('last_synced_at', desc=False).execute()
-    accounts = response.data
+    response = get_supabase().table('instagram_accounts').select(ACCOUNT_COLUMNS).order('priority', desc=False).order('last_synced_at', desc=False).execute()
+    accounts = [Account.from_row(row) for row in response.data]
     
-    print(f"Found {len(accounts)} accounts to process.")
+    log.info("Found %d accounts to process.", len(accounts))
     
-    for account in accounts:
-        if RequestContext.total_requests_this_run >= RequestContext.MAX_REQUESTS_ALLOWED:
-            print("Max requests allowed reached for this batch. Stopping.")
-            break
-            
-        try:
-            # 1. Refresh Token
-            refresh_token(account)
-            
-            # Check limit again
-            if RequestContext.total_requests_this_run >= RequestContext.MAX_REQUESTS_ALLOWED:
-                break
-                
-            # 2. Fetch New Posts
-            fetch_new_posts(account)
+    # Accounts use independent tokens, so their Graph API calls can overlap
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(_process_account, account): account for account in accounts}
+        for future in as_completed(futures):
+            account = futures[future]
+            try:
+                future.result()
+            except Exception:
+                log.exception("Error processing account %s", account.account_name)
             
-            # Sleep to be nice to API
-            time.sleep(2)
-            
-        except Exception as e:
-            print(f"Error processing account {account['account_name'] if isinstance(account, dict) and 'account_name' in account else 'Unknown'}: {e}")
-            continue
-            
-    print(f"Batch run completed. Total requests: {RequestContext.total_requests_this_run}")
+    log.info("Batch run completed. Total requests: %d", RequestContext.total_requests_this_run)
 
 if __name__ == "__main__":
+    configure_logging()
+
     # Reset counter at start of run
-    RequestContext.total_requests_this_run = 0
+    RequestContext.reset()
     
     seed_initial_account()
     
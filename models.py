@@ -0,0 +1,27 @@
+from dataclasses import dataclass, fields
+from typing import Optional
+
+@dataclass(slots=True)
+class Account:
+    """
+    Row of instagram_accounts as used by the sync.
+    """
+    id: int
+    account_name: str
+    ig_user_id: str
+    access_token: str
+    token_expires_at: str
+    last_synced_at: Optional[str] = None
+    priority: int = 2
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        Builds an Account from a Supabase row, ignoring columns the sync doesn't use.
+        """
+        return cls(**{name: row[name] for name in ACCOUNT_FIELDS if name in row})
+
+ACCOUNT_FIELDS = tuple(field.name for field in fields(Account))
+
+# instagram_accounts columns the sync reads; avoids pulling every column with select("*")
+ACCOUNT_COLUMNS = ",".join(ACCOUNT_FIELDS)
@@ -1,83 +1,144 @@
+import logging
 import os
-import requests
+import re
+import orjson
 from datetime import datetime, timedelta, timezone
-from config import supabase
-from utils import get_instagram_api_url
+from config import get_supabase
+from models import Account
+from utils import get_instagram_api_url, graph_get
 from auth import refresh_token
 from globals import RequestContext
 
-def seed_account(ig_user_id, access_token):
+log = logging.getLogger(__name__)
+
+_USER_ID_KEY = re.compile(r'^INSTAGRAM_USER_ID(.*)$')
+
+NAME_PARAMS = {'fields': 'name'}
+# Stored until the real name is fetched after the account is inserted
+PLACEHOLDER_NAME = 'Initial Account'
+
+# Seeded tokens are stored as already expired so refresh_token refreshes them on first run
+FORCE_REFRESH_EXPIRY = '1970-01-01T00:00:00+00:00'
+
+# Env accounts only change on restart, so re-check the database at most once per TTL
+SEED_CHECK_TTL = timedelta(hours=1)
+_SEED_CACHE = {"checked_at": None, "credentials": None}
+
+def _fetch_account_name(ig_user_id, access_token):
     """
-    Seeds a single account if it doesn't exist.
+    Fetches the Instagram account name. Returns None if it couldn't be fetched.
     """
-    if not ig_user_id or not access_token:
+    account_name = None
+    if not RequestContext.record_request():
+        log.warning("Rate limit reached, skipping account name fetch.")
+        return account_name
+
+    if not RequestContext.acquire_account_slot(ig_user_id):
+        RequestContext.release_request()
+        log.warning("Hourly limit reached for %s, skipping account name fetch.", ig_user_id)
+        return account_name
+
+    try:
+        response = graph_get(get_instagram_api_url(ig_user_id), {**NAME_PARAMS, 'access_token': access_token})
+        if response.status_code == 200:
+            data = orjson.loads(response.content)
+            account_name = data.get('name')
+            log.info("Fetched account name: %s", account_name)
+        else:
+            log.error("Failed to fetch account name: %s", response.text)
+    except Exception:
+        log.exception("Error fetching account name")
+    return account_name
+
+def seed_accounts(credentials):
+    """
+    Seeds every (ig_user_id, access_token, account_name) entry that doesn't exist yet.
+    Uses one lookup and one bulk upsert regardless of how many accounts are configured.
+    account_name may be None; a placeholder is then stored and replaced with the
+    name from Graph once the account is inserted and its token refreshed.
+    """
+    accounts = {ig_user_id: (access_token, account_name) for ig_user_id, access_token, account_name in credentials if ig_user_id and access_token}
+    if not accounts:
         return
 
-    # Check if exists
-    res = supabase.table('instagram_accounts').select("*").eq('ig_user_id', ig_user_id).execute()
-    if not res.data:
-        print(f"Seeding account {ig_user_id} from .env...")
-
-        # Fetch the actual Instagram account name
-        account_name = 'Initial Account'  # Fallback
-        try:
-            response = requests.get(get_instagram_api_url(f"{ig_user_id}"), params={
-                'fields': 'name',
-                'access_token': access_token
-            })
-            if response.status_code == 200:
-                data = response.json()
-                account_name = data.get('name', 'Initial Account')
-                print(f"Fetched account name: {account_name}")
-                RequestContext.total_requests_this_run += 1
-            else:
-                print(f"Failed to fetch account name: {response.text}")
-        except Exception as e:
-            print(f"Error fetching account name: {e}")
-
-        # Temporary set expiry token to be now to force refresh on first run
-        expires_at = datetime.now(timezone.utc)
-        
-        account_data = {
+    # Check which accounts already exist; only the key is needed
+    res = get_supabase().table('instagram_accounts').select('ig_user_id').in_('ig_user_id', list(accounts)).execute()
+    existing = {row['ig_user_id'] for row in res.data}
+
+    new_accounts = []
+    for ig_user_id, (access_token, account_name) in accounts.items():
+        if ig_user_id in existing:
+            log.info("Account %s already exists.", ig_user_id)
+            continue
+
+        log.info("Seeding account %s from .env...", ig_user_id)
+        new_accounts.append({
             'ig_user_id': ig_user_id,
-            'account_name': account_name,
+            'account_name': account_name or PLACEHOLDER_NAME,
             'access_token': access_token,
-            'token_expires_at': expires_at.isoformat(),
+            'token_expires_at': FORCE_REFRESH_EXPIRY,
             'priority': 2 # Default priority is 2
-        }
-        supabase.table('instagram_accounts').insert(account_data).execute()
-        account = supabase.table('instagram_accounts').select("*").eq('ig_user_id', ig_user_id).execute().data[0]
-        refresh_token(account)
+        })
+
+    if not new_accounts:
+        return
 
-        print(f"Account {ig_user_id} seeded.")
-    else:
-        print(f"Account {ig_user_id} already exists.")
+    # ON CONFLICT DO NOTHING; the response only contains rows that were actually inserted
+    inserted = get_supabase().table('instagram_accounts').upsert(new_accounts, on_conflict='ig_user_id', ignore_duplicates=True).execute()
+    for row in inserted.data:
+        account = Account.from_row(row)
+        refresh_token(account)
+        if account.account_name == PLACEHOLDER_NAME:
+            # refresh_token updates account.access_token in place, so this uses the fresh token
+            account_name = _fetch_account_name(account.ig_user_id, account.access_token)
+            if account_name:
+                get_supabase().table('instagram_accounts').update({'account_name': account_name}).eq('ig_user_id', account.ig_user_id).execute()
+        log.info("Account %s seeded.", row['ig_user_id'])
 
-def seed_initial_account():
+def seed_account(ig_user_id, access_token, account_name=None):
     """
-    Scans environment variables for INSTAGRAM_USER_ID* and seeds them.
+    Seeds a single account if it doesn't exist.
     """
-    print("Scanning environment variables for seed accounts...")
-    
-    # Find all keys that start with INSTAGRAM_USER_ID
-    env_vars = os.environ
-    user_keys = [key for key in env_vars if key.startswith("INSTAGRAM_USER_ID")]
-    
-    if not user_keys:
-        print("No INSTAGRAM_USER_ID* variables found in environment.")
-        return
+    seed_accounts([(ig_user_id, access_token, account_name)])
 
-    for user_key in user_keys:
-        user_id = env_vars.get(user_key)
-        if not user_id:
+def _iter_env_credentials():
+    """
+    Yields (ig_user_id, access_token, account_name) for each INSTAGRAM_USER_ID* variable
+    that has a matching INSTAGRAM_ACCESS_TOKEN* (same suffix, e.g. "", "_2", "_3").
+    account_name comes from the optional INSTAGRAM_ACCOUNT_NAME* with that suffix.
+    """
+    for key, user_id in os.environ.items():
+        match = _USER_ID_KEY.match(key)
+        if not match or not user_id:
             continue
-            
-        # Determine the suffix (e.g., "", "_2", "_3") to find matching token
-        suffix = user_key.replace("INSTAGRAM_USER_ID", "")
+
+        suffix = match.group(1)
         token_key = f"INSTAGRAM_ACCESS_TOKEN{suffix}"
-        access_token = env_vars.get(token_key)
-        
+        access_token = os.environ.get(token_key)
         if access_token:
-            seed_account(user_id, access_token)
+            yield user_id, access_token, os.environ.get(f"INSTAGRAM_ACCOUNT_NAME{suffix}")
         else:
-            print(f"Skipping {user_key}: No corresponding {token_key} found.")
+            log.warning("Skipping %s: No corresponding %s found.", key, token_key)
+
+def seed_initial_account():
+    """
+    Seeds the INSTAGRAM_USER_ID* accounts found in the environment at startup.
+    Skipped if the accounts were already verified within SEED_CHECK_TTL.
+    """
+    # Environment variables only change on restart, so resolve the seed accounts on the
+    # first call (after logging is configured) and reuse them afterwards
+    if _SEED_CACHE["credentials"] is None:
+        _SEED_CACHE["credentials"] = tuple(_iter_env_credentials())
+    credentials = _SEED_CACHE["credentials"]
+    if not credentials:
+        return
+
+    checked_at = _SEED_CACHE["checked_at"]
+    if checked_at and datetime.now(timezone.utc) - checked_at < SEED_CHECK_TTL:
+        log.info("Seed accounts verified recently, skipping.")
+        return
+
+    log.info("Verifying %d seed accounts from environment...", len(credentials))
+    seed_accounts(credentials)
+
+    _SEED_CACHE["checked_at"] = datetime.now(timezone.utc)
@@ -1,16 +1,28 @@
-from fastapi import FastAPI, BackgroundTasks
+import asyncio
+import logging
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from main import run_batch, seed_initial_account
 from globals import RequestContext
+from utils import configure_logging
+
+log = logging.getLogger(__name__)
+
+configure_logging()
 
 app = FastAPI()
 
-def run_sync_task():
+# Only one sync may run at a time; overlapping runs would duplicate Graph API calls
+RUN_LOCK = asyncio.Lock()
+# Strong references so running tasks aren't garbage collected
+_running_tasks = set()
+
+def _run_sync():
     """
-    Wrapper to run the sync task in background.
+    Seeds accounts and runs the batch. Blocking, so it runs off the event loop.
     """
-    print("Triggering background sync task...")
     # Reset counter at start of run
-    RequestContext.total_requests_this_run = 0
+    RequestContext.reset()
     
     # Ensure initial seed (optional, but good for consistency)
     seed_initial_account()
@@ -18,15 +30,39 @@ def run_sync_task():
     # Run the batch
     run_batch()
 
+async def run_sync_task():
+    """
+    Wrapper to run the sync task in background.
+    Awaited on the event loop, so it doesn't hold one of Starlette's threadpool slots.
+    """
+    log.info("Triggering background sync task...")
+    await asyncio.to_thread(_run_sync)
+
 @app.get("/")
 def read_root():
     return {"status": "Connect3 Instagram Ingestion Service is running"}
 
+async def _guarded_run():
+    try:
+        await run_sync_task()
+    except Exception:
+        log.exception("Background sync failed")
+    finally:
+        RUN_LOCK.release()
+
 @app.post("/run-task")
-def trigger_task(background_tasks: BackgroundTasks):
+async def trigger_task():
     """
     Endpoint to trigger the batch sync process.
     Returns immediately while the task runs in the background.
     """
-    background_tasks.add_task(run_sync_task)
+    if RUN_LOCK.locked():
+        return JSONResponse({"status": "busy", "message": "A batch sync task is already running"}, status_code=409)
+
+    # Taken here rather than inside the task, so a second trigger arriving before
+    # the task starts still sees the run as in progress
+    await RUN_LOCK.acquire()
+    task = asyncio.create_task(_guarded_run())
+    _running_tasks.add(task)
+    task.add_done_callback(_running_tasks.discard)
     return {"status": "started", "message": "Batch sync task has been triggered in the background"}
@@ -1,5 +1,66 @@
+import atexit
+import logging
+import queue
+import sys
+import requests
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) timeout in seconds for Graph API calls
+GRAPH_TIMEOUT = (3, 10)
+
+# Shared HTTP session so Graph API calls reuse pooled keep-alive connections
+session = requests.Session()
+session.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    # Only retry failed connects: those never reach Graph, so they don't need to be counted
+    # against RequestContext's budgets. Anything that got a response (429/5xx included) is
+    # returned to the caller, which has already reserved the call.
+    max_retries=Retry(total=3, connect=3, read=0, status=0, other=0, backoff_factor=0.5,
+                      respect_retry_after_header=False, raise_on_status=False)
+))
+
+def graph_get(url, params=None):
+    """
+    GETs a Graph API URL through the shared session with the standard timeout.
+    """
+    return session.get(url, params=params, timeout=GRAPH_TIMEOUT)
+
 def get_instagram_api_url(endpoint):
     return f"https://graph.instagram.com/v24.0/{endpoint}"
 
 def get_facebook_api_url(endpoint):
     return f"https://graph.facebook.com/{endpoint}"
+
+def parse_timestamp(value):
+    """
+    Parses an ISO-8601 timestamp from the Graph API or Supabase into an aware datetime.
+    Python 3.11+ fromisoformat handles 'Z' and '+0000' offsets natively; naive values
+    (timestamp columns without a zone) are treated as UTC.
+    """
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def configure_logging(level=logging.INFO):
+    """
+    Routes log records through a queue so callers only enqueue them;
+    a listener thread does the blocking writes to stdout.
+    """
+    root = logging.getLogger()
+    if any(isinstance(handler, QueueHandler) for handler in root.handlers):
+        return
+
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+    # supabase-py's httpx client logs every PostgREST request at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)